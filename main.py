@@ -3,6 +3,11 @@ import asyncio
 import secrets
 import tempfile
 
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
 from multi_chord import command_handler
 from multi_chord import timings
 from multi_chord import node_pool
@@ -23,6 +28,8 @@ async def main():
                         help="Time between keep-alive pings")
     parser.add_argument("--command-interval", metavar="seconds", type=float, help="Rpc call timeout")
     parser.add_argument("--get-data-timeout", metavar="seconds", type=float, help="Rpc get data call timeout")
+    parser.add_argument("--batch-window", metavar="seconds", type=float,
+                        help="Time outgoing rpc requests are held back to be batched")
     parser.add_argument("--scenario-host-random", action="store_true", help="Host random temporary file.")
     parser.add_argument("--scenario-local-file", metavar="file", help="Host specified file.")
     parser.add_argument("--scenario-join-remote", nargs=2, metavar=("id", "file"),
@@ -40,10 +47,12 @@ async def main():
     if args.live_interval is not None:
         timings_args["live_interval"] = args.live_interval
     if args.command_interval is not None:
-        timings_args["command_interval"] = args.command_interval
+        timings_args["command_timeout"] = args.command_interval
     if args.get_data_timeout is not None:
         timings_args["get_data_timeout"] = args.get_data_timeout
-    t = timings.Timings(*timings_args)
+    if args.batch_window is not None:
+        timings_args["batch_window"] = args.batch_window
+    t = timings.Timings(**timings_args)
     pool = node_pool.NodePool(server, t)
 
     if args.bootstrap:
@@ -58,9 +67,9 @@ async def main():
         f = tempfile.NamedTemporaryFile("wb+")
         f.write(secrets.randbits(512).to_bytes(64, "little", signed=False))
         f.flush()
-        ch.host_local_file(f)
+        await ch.host_local_file(f)
     if args.scenario_local_file is not None:
-        ch.host_local_file(args.scenario_local_file)
+        await ch.host_local_file(args.scenario_local_file)
     if args.scenario_join_remote is not None:
         ch.join_remote(args.scenario_join_remote[0], args.scenario_join_remote[1])
 
@@ -69,8 +78,9 @@ async def main():
 
 
 if __name__ == "__main__":
-    task = asyncio.get_event_loop().create_task(main(), name="main")
-    try:
-        asyncio.get_event_loop().run_until_complete(task)
-    except KeyboardInterrupt:
-        task.cancel()
+    with asyncio.Runner(loop_factory=uvloop.new_event_loop if uvloop is not None else None) as runner:
+        try:
+            runner.run(main())
+        except KeyboardInterrupt:
+            # runner has already cancelled main task
+            pass
@@ -1,8 +1,9 @@
 import asyncio
-import hashlib
 import sys
-from typing import BinaryIO
+import traceback
+from typing import BinaryIO, Callable
 
+from . import content_hash
 from . import swarm_id
 from . import hosted_virtual_node
 from . import node_pool
@@ -18,50 +19,83 @@ jr, join-remote file_id file_path - join remote swarm with file_id and download
 lvn, ls, list-virtual-nodes - list hosted virtual nodes
 h, help - print this help message
 e, q, exit - exit program"""
+    workers_count = 2
 
     def __init__(self, pool: node_pool.NodePool):
         self._node_pool = pool
+        self._queue: asyncio.Queue[bytes] = asyncio.Queue(maxsize=16)
+        # command name -> (arguments count, handler)
+        self._commands: dict[bytes, tuple[int, Callable]] = {
+            name: (args_count, handler)
+            for names, args_count, handler in (
+                ((b"host-local", b"hl", b"host"), 1, self.host_local_file),
+                ((b"join-remote", b"jr"), 2, self.join_remote),
+                ((b"list-virtual-nodes", b"lvn", b"ls"), 0, self.list_virtual_nodes),
+                ((b"help", b"h"), 0, self._print_help),
+            )
+            for name in names}
 
     async def run(self):
         """
-        Reads commands from stdin and executes them.
+        Reads commands from stdin and passes them to command workers.
         """
         reader = await _get_steam_reader(sys.stdin)
+        workers = [asyncio.get_running_loop().create_task(self._worker()) for _ in range(CommandHandler.workers_count)]
         print("Enter commands:")
+        try:
+            while True:
+                line = (await reader.readline()).strip()
+                if line == b"exit" or line == b"e" or line == b"q":
+                    break
+                await self._queue.put(line)
+            await self._queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+    async def _worker(self):
+        """
+        Executes queued commands. Several workers let long-running commands proceed while next commands are read.
+        """
         while True:
-            line = await reader.readline()
-            line = line.decode("utf-8").strip()
-            if line == "exit" or line == "e" or line == "q":
-                break
-            self.handle(line)
+            line = await self._queue.get()
+            try:
+                await self.handle(line)
+            except Exception:
+                print(traceback.format_exc())
+            finally:
+                self._queue.task_done()
 
-    def handle(self, line: str):
+    async def handle(self, line: bytes):
         """
-        Tries to handle user input as a command.
+        Tries to handle user input as a command. Command names are ascii, so input is decoded only for arguments.
         """
-        command = line.split(" ")
+        command = line.split(b" ")
         name, args = command[0], command[1:]
-        if (name == "host-local" or name == "hl" or name == "host") and len(args) == 1:
-            self.host_local_file(args[0])
-        elif (name == "join-remote" or name == "jr") and len(args) == 2:
-            self.join_remote(args[0], args[1])
-        elif (name == "list-virtual-nodes" or name == "lvn" or name == "ls") and len(args) == 0:
-            self.list_virtual_nodes()
-        elif (name == "help" or name == "h") and len(args) == 0:
-            print(CommandHandler.help_message)
-        else:
+        spec = self._commands.get(name)
+        if spec is None or spec[0] != len(args):
             print("Unknown command. Type \"help\" to get a list of available commands.")
+            return
+        result = spec[1](*(arg.decode("utf-8") for arg in args))
+        if asyncio.iscoroutine(result):
+            await result
+
+    def _print_help(self):
+        """
+        Prints CLI help to stdout.
+        """
+        print(CommandHandler.help_message)
 
-    def host_local_file(self, file: str | BinaryIO):
+    async def host_local_file(self, file: str | BinaryIO):
         """
-        Creates a new hosted virtual nodes with available node value.
+        Creates a new hosted virtual nodes with available node value. File is hashed in a separate thread, so
+        the event loop keeps processing rpc messages meanwhile.
         :param file: node value
         """
         if isinstance(file, str):
             file = open(file, "rb")
         file.seek(0, 0)
-        data = file.read()
-        id_bytes = hashlib.sha3_512(data).digest()
+        id_bytes = await asyncio.to_thread(content_hash.file_digest, file)
         file_id = swarm_id.SwarmId(id_bytes)
         node = hosted_virtual_node.HostedVirtualNode(file_id)
         node.set_content_path(file, True)
@@ -102,7 +136,7 @@ async def _get_steam_reader(pipe) -> asyncio.StreamReader:
     :param pipe: sys pipe object
     :return: asyncio wrapper
     """
-    loop = asyncio.get_event_loop()
+    loop = asyncio.get_running_loop()
     reader = asyncio.StreamReader(loop=loop)
     protocol = asyncio.StreamReaderProtocol(reader)
     await loop.connect_read_pipe(lambda: protocol, pipe)
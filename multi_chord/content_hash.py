@@ -0,0 +1,32 @@
+import hashlib
+from typing import BinaryIO
+
+try:
+    from Crypto.Hash import SHA3_512
+except ImportError:
+    SHA3_512 = None
+
+
+def new():
+    """
+    Creates a new sha3-512 hash object. Uses pycryptodome implementation if it is installed, hashlib otherwise.
+    :return: hash object with update() and digest() methods
+    """
+    if SHA3_512 is not None:
+        return SHA3_512.new()
+    return hashlib.sha3_512()
+
+
+def file_digest(file: BinaryIO) -> bytes:
+    """
+    Calculates sha3-512 digest of the file without loading the whole file into memory.
+    :param file: binary file object positioned at the beginning of the data
+    :return: digest of the file content
+    """
+    if hasattr(hashlib, "file_digest"):
+        return hashlib.file_digest(file, new).digest()
+    h = new()
+    buf = memoryview(bytearray(1 << 20))
+    while n := file.readinto(buf):
+        h.update(buf[:n])
+    return h.digest()
@@ -1,9 +1,9 @@
 import asyncio
-import hashlib
-import datetime
-import random
-from typing import Optional, BinaryIO
+import itertools
+import mmap
+from typing import Optional, BinaryIO, Callable
 
+from . import content_hash
 from . import remote_node
 from . import swarm_id
 from . import rpc
@@ -16,10 +16,12 @@ class AliveRemoteNode:
     and raises send_ping flag. If remote node can not respond within command time, it will be deleted at the next
     stabilization round.
     """
+    __slots__ = ("remote", "timeout", "sent_ping")
 
-    def __init__(self, remote: remote_node.RemoteNode, ttl: float):
+    def __init__(self, remote: remote_node.RemoteNode, timeout: float):
         self.remote = remote
-        self.timeout = datetime.datetime.now() + datetime.timedelta(seconds=ttl)
+        # deadline in event loop monotonic time
+        self.timeout = timeout
         self.sent_ping = False
 
     def __str__(self):
@@ -28,15 +30,21 @@ class AliveRemoteNode:
 
 class PendingRequest:
     """
-    Helper class to keep track of pending request.
+    Helper class to keep track of pending request. Response is accepted only from the callee address.
     """
+    __slots__ = ("address", "request_type", "future")
 
-    def __init__(self, request_type: rpc.RpcMessageType, future: asyncio.Future):
+    def __init__(self, address: str, request_type: rpc.RpcMessageType, future: asyncio.Future):
+        self.address = address
         self.request_type = request_type
         self.future = future
 
 
 _finger_table_size = 10
+# request ids are 32-bit unsigned integers on the wire
+_req_id_limit = 2 ** 32
+# block size used to hash and write downloaded content in one pass
+_store_block_size = 1 << 16
 
 
 class HostedVirtualNode:
@@ -48,14 +56,27 @@ class HostedVirtualNode:
 
     def __init__(self, node_id: swarm_id.SwarmId):
         self.id = node_id
+        # finger upper bounds and predecessor upper bound depend only on node id
+        self._ideal_ids = tuple(node_id.advance(1 << (swarm_id.SwarmId.bit_size - _finger_table_size + i))
+                                for i in range(_finger_table_size))
+        self._id_minus_1 = node_id.advance(-1)
+        # swarm members ping request is the same for all members, request id is assigned at send time
+        self._swarm_ping = rpc.RpcPingRequest(node_id, node_id)
         self.file: Optional[BinaryIO] = None
         self.has_content = False
-        self._pending_requests: dict[remote_node.RemoteNode, PendingRequest] = {}
-        self._swarm: list[AliveRemoteNode] = []
+        self._content: bytes | memoryview = b""
+        self._pending_requests: dict[int, PendingRequest] = {}
+        self._next_req_id = 0
+        self._coalesced_requests: dict[tuple, asyncio.Future] = {}
+        # network lookup results: query id -> (found node, expiration time)
+        self._lookup_cache: dict[swarm_id.SwarmId, tuple[remote_node.RemoteNode, float]] = {}
+        # swarm members indexed by their network address
+        self._swarm: dict[str, AliveRemoteNode] = {}
         self.finger_table: list[Optional[AliveRemoteNode]] = [None] * _finger_table_size
         self.predecessor: Optional[AliveRemoteNode] = None
         self.successor: Optional[AliveRemoteNode] = None
         self.node_pool = None
+        self._loop = asyncio.get_running_loop()
 
     def set_content_path(self, file: BinaryIO, has_content: bool):
         """
@@ -66,35 +87,61 @@ class HostedVirtualNode:
         """
         self.file = file
         self.has_content = has_content
+        if has_content:
+            self._map_content()
+
+    def _map_content(self):
+        """
+        Maps node value file into memory, so GetContent requests are served without reading and copying the file.
+        """
+        self.file.flush()
+        try:
+            self._content = memoryview(mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ))
+        except ValueError:
+            # empty file can not be mapped
+            self._content = b""
 
     def process_message(self, remote: remote_node.RemoteNode, message: rpc.RpcMessage):
         """Handles rpc requests from remote nodes and resolves rpc responses from this node. Common virtual node
         supports ping requests, GetSwarm requests and GetContent requests"""
         assert message.to_id == self.id
         if message.command.value % 2 == 1:
-            if remote in self._pending_requests:
-                pending_request = self._pending_requests[remote]
-                if pending_request.request_type.value + 1 == message.command.value:
-                    pending_request.future.set_result(message)
-        elif isinstance(message, rpc.RpcPingRequest):
-            self._try_stabilize_with_remote(AliveRemoteNode(remote, self.node_pool.timings.live_interval))
-            self.node_pool.send_message(remote, rpc.RpcPingResponse(self.id, remote.id))
-        elif isinstance(message, rpc.RpcGetSwarmRequest):
-            self.node_pool.send_message(remote, rpc.RpcGetSwarmResponse(self.id, remote.id, list(
-                map(lambda x: x.remote, self._swarm))))
-        elif isinstance(message, rpc.RpcGetContentRequest):
-            if self.has_content:
-                self.file.seek(0, 0)
-                data = self.file.read()
-                self.node_pool.send_message(remote, rpc.RpcGetContentResponse(self.id, remote.id, data))
-            else:
-                self.node_pool.send_message(remote, rpc.RpcGetContentResponse(self.id, remote.id, b""))
+            pending_request = self._pending_requests.get(message.req_id)
+            if (pending_request is not None and pending_request.address == remote.address and
+                    pending_request.request_type.value + 1 == message.command.value and
+                    not pending_request.future.done()):
+                pending_request.future.set_result(message)
+            return
+        handler = HostedVirtualNode._request_handlers.get(message.command)
+        if handler is not None:
+            handler(self, remote, message)
+
+    def _handle_ping(self, remote: remote_node.RemoteNode, message: rpc.RpcPingRequest):
+        self._try_stabilize_with_remote(AliveRemoteNode(remote, self._live_deadline()))
+        self.node_pool.send_message(remote, rpc.RpcPingResponse(self.id, remote.id, message.req_id))
+
+    def _handle_get_swarm(self, remote: remote_node.RemoteNode, message: rpc.RpcGetSwarmRequest):
+        self.node_pool.send_message(remote, rpc.RpcGetSwarmResponse(
+            self.id, remote.id, [node.remote for node in self._swarm.values()], message.req_id))
+
+    def _handle_get_content(self, remote: remote_node.RemoteNode, message: rpc.RpcGetContentRequest):
+        self.node_pool.send_message(remote, rpc.RpcGetContentResponse(self.id, remote.id, self._content,
+                                                                      message.req_id))
+
+    # request type -> handler, looked up once per incoming request instead of a chain of isinstance checks
+    _request_handlers: dict[rpc.RpcMessageType, Callable] = {
+        rpc.RpcMessageType.PING_REQUEST: _handle_ping,
+        rpc.RpcMessageType.GET_SWARM_REQUEST: _handle_get_swarm,
+        rpc.RpcMessageType.GET_CONTENT_REQUEST: _handle_get_content,
+    }
 
     async def send_request(self, remote: remote_node.RemoteNode, request: rpc.RpcMessage,
                            timeout: float) -> Optional[rpc.RpcMessage]:
         """
-        Sends request and waits timeout seconds for response from remote node. It is guaranteed that response will
-        have correct message type.
+        Sends request and waits timeout seconds for response from remote node. Every request gets its own request id,
+        so several requests to the same remote node may be in flight simultaneously. Identical requests to the same
+        remote node are coalesced: callers share the response of the request that is already in flight. It is
+        guaranteed that response will have correct message type.
         :param remote: remote callee node.
         :param request: rpc request message.
         :param timeout: response waiting timeout.
@@ -103,23 +150,39 @@ class HostedVirtualNode:
         assert request.to_id == remote.id
         assert request.from_id == self.id
 
-        now = datetime.datetime.now()
-        timeout_point = now + datetime.timedelta(seconds=timeout)
-        f = asyncio.get_event_loop().create_future()
-        # wait for a pending request to complete it there are any requests to specified ndoe.
-        if remote in self._pending_requests:
-            try:
-                await asyncio.wait_for(self._pending_requests[remote].future, timeout)
-            except (asyncio.TimeoutError, asyncio.CancelledError):
+        # all rpc requests are idempotent, so identical in-flight request may answer this call too
+        key = (remote.address, request.to_id, request.command, request.payload())
+        in_flight = self._coalesced_requests.get(key)
+        if in_flight is not None:
+            # asyncio.wait does not cancel shared future on timeout. Cancellation of the caller propagates
+            await asyncio.wait((in_flight,), timeout=timeout)
+            if not in_flight.done() or in_flight.cancelled():
                 return None
-        self._pending_requests[remote] = PendingRequest(request.command, f)
-        self.node_pool.send_message(remote, request)
+            return in_flight.result()
+
+        f = self._loop.create_future()
+        self._coalesced_requests[key] = f
+        req_id = self._next_req_id
+        self._next_req_id = (req_id + 1) % _req_id_limit
+        request.req_id = req_id
+        self._pending_requests[req_id] = PendingRequest(remote.address, request.command, f)
+        # timeout cancels the response future directly instead of wrapping it with asyncio.wait_for
+        timer = self._loop.call_later(timeout, f.cancel)
         try:
-            val = await asyncio.wait_for(f, (timeout_point - datetime.datetime.now()).total_seconds())
-        except (asyncio.TimeoutError, asyncio.CancelledError):
+            # pending request records are removed below even if the request can not be sent
+            self.node_pool.send_batched(remote, request)
+            val = await f
+        except asyncio.CancelledError:
+            # only the timeout timer cancellation means no response, cancellation of the caller itself propagates
+            if asyncio.current_task().cancelling():
+                raise
             val = None
         finally:
-            del self._pending_requests[remote]
+            timer.cancel()
+            # release callers waiting on the coalesced request if it failed before the response
+            f.cancel()
+            del self._pending_requests[req_id]
+            del self._coalesced_requests[key]
         return val
 
     async def stabilize_run(self):
@@ -129,69 +192,97 @@ class HostedVirtualNode:
         remote nodes.
         """
         while True:
-            # stabilizes finger table, successor and predecessor nodes
-            for i in range(_finger_table_size):
-                ideal_id = self.id.advance(2 ** (swarm_id.SwarmId.bit_size - _finger_table_size + i))
-                self.finger_table[i] = await self._stabilize_to_id_from_below(self.finger_table[i], ideal_id)
-            self.predecessor = await self._stabilize_to_id_from_below(self.predecessor, self.id.advance(-1))
+            # stabilizes finger table and predecessor concurrently, successor depends on the finger table
+            results = await asyncio.gather(
+                *(self._stabilize_to_id_from_below(self.finger_table[i], self._ideal_ids[i])
+                  for i in range(_finger_table_size)),
+                self._stabilize_to_id_from_below(self.predecessor, self._id_minus_1))
+            self.finger_table[:] = results[:-1]
+            self.predecessor = results[-1]
             await self._stabilize_successor()
 
             # search for a swarm if it is not found yet
             if len(self._swarm) == 0:
                 swarm_node = await self._network_get_pred_or_eq(self.id)
                 if swarm_node is not None and swarm_node.id == self.id:
-                    self._swarm.append(AliveRemoteNode(swarm_node, self.node_pool.timings.live_interval))
+                    self._swarm[swarm_node.address] = AliveRemoteNode(swarm_node, self._live_deadline())
             await self._update_swarm()
 
             # retrieve node value from the swarm if required
             if not self.has_content:
-                for node in self._swarm:
-                    resp: Optional[rpc.RpcGetContentResponse] = \
-                        await self.send_request(node.remote, rpc.RpcGetContentRequest(self.id, node.remote.id),
-                                                self.node_pool.timings.get_data_timeout)
-                    if resp is not None and len(resp.data) > 0:
-                        self.file.write(resp.data)
-                        self.has_content = True
-                        digest = hashlib.sha3_512(resp.data).digest()
-                        if digest != self.id.id:
-                            print(f"wrong content hash for {self.id.hex()}!!!")
-                        else:
-                            print(f"got valid content for {self.id.hex()}")
-                        break
+                await self._download_content()
 
             await asyncio.sleep(self.node_pool.timings.stabilize_interval)
 
+    async def _download_content(self):
+        """
+        Requests node value from all swarm members simultaneously and stores the first non-empty response. Remaining
+        requests are cancelled.
+        """
+        tasks = [self._loop.create_task(
+            self.send_request(node.remote, rpc.RpcGetContentRequest(self.id, node.remote.id),
+                              self.node_pool.timings.get_data_timeout)) for node in self._swarm.values()]
+        try:
+            for next_response in asyncio.as_completed(tasks):
+                resp: Optional[rpc.RpcGetContentResponse] = await next_response
+                if resp is not None and len(resp.data) > 0:
+                    # hashing releases the GIL, so large content is stored without blocking the event loop
+                    digest = await asyncio.to_thread(self._store_content, resp.data)
+                    self.has_content = True
+                    self._map_content()
+                    if digest != self.id.id:
+                        print(f"wrong content hash for {self.id.hex()}!!!")
+                    else:
+                        print(f"got valid content for {self.id.hex()}")
+                    return
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def _store_content(self, data: bytes) -> bytes:
+        """
+        Writes downloaded node value to the file storage and hashes it in the same pass. Data is processed block by
+        block, so every block is still in cache when it is written after hashing.
+        :param data: downloaded node value.
+        :return: digest of the node value.
+        """
+        hasher = content_hash.new()
+        view = memoryview(data)
+        for offset in range(0, len(view), _store_block_size):
+            block = view[offset:offset + _store_block_size]
+            hasher.update(block)
+            self.file.write(block)
+        return hasher.digest()
+
     async def _update_swarm(self):
         """
         Updates swarm members list. Retrieves members list from all nodes in swarm and merges this lists in a new one.
         """
         new_swarm = set()
-        for node in self._swarm:
-            resp: Optional[rpc.RpcGetSwarmResponse] = \
-                await self.send_request(node.remote, rpc.RpcGetSwarmRequest(self.id, node.remote.id),
-                                        self.node_pool.timings.command_timeout)
+        swarm = list(self._swarm.values())
+        responses: list[Optional[rpc.RpcGetSwarmResponse]] = await asyncio.gather(
+            *(self.send_request(node.remote, rpc.RpcGetSwarmRequest(self.id, node.remote.id),
+                                self.node_pool.timings.command_timeout) for node in swarm))
+        for node, resp in zip(swarm, responses):
             if resp is None:
                 continue
             new_swarm.add(node.remote.address)
-            for n in resp.swarm:
-                new_swarm.add(n.address)
+            new_swarm.update(n.address for n in resp.swarm)
         self._swarm = await self._filter_swarm(new_swarm)
 
-    async def _filter_swarm(self, swarm: set) -> list[AliveRemoteNode]:
+    async def _filter_swarm(self, swarm: set) -> dict[str, AliveRemoteNode]:
         """
         Simultaneously pings all nodes in the list and waits for responses.
         :param swarm: nodes list to ping.
-        :return: list of all nodes that responded to ping in time.
+        :return: all nodes that responded to ping in time indexed by their address.
         """
-        d = [self.send_request(remote_node.RemoteNode(self.id, addr), rpc.RpcPingRequest(self.id, self.id),
-                               self.node_pool.timings.command_timeout) for addr in swarm]
-        arr = []
-        for a, n in zip(d, swarm):
-            resp = await a
-            if resp is None:
-                continue
-            arr.append(AliveRemoteNode(remote_node.RemoteNode(self.id, n), self.node_pool.timings.live_interval))
-        return arr
+        remotes = [remote_node.RemoteNode(self.id, addr) for addr in swarm]
+        responses = await asyncio.gather(*(self.send_request(remote, self._swarm_ping,
+                                                             self.node_pool.timings.command_timeout)
+                                           for remote in remotes))
+        deadline = self._live_deadline()
+        return {remote.address: AliveRemoteNode(remote, deadline)
+                for remote, resp in zip(remotes, responses) if resp is not None}
 
     async def _stabilize_to_id_from_below(self, node: Optional[AliveRemoteNode], ideal_id: swarm_id.SwarmId) -> \
             Optional[AliveRemoteNode]:
@@ -204,13 +295,13 @@ class HostedVirtualNode:
         if not await self._check_alive(node):
             n = await self._network_get_pred_or_eq(ideal_id)
             if n is not None:
-                return AliveRemoteNode(n, self.node_pool.timings.live_interval)
+                return AliveRemoteNode(n, self._live_deadline())
             else:
                 return None
         else:
             successor = await self._remote_get_node_call(node.remote, ideal_id)
-            if successor is not None and successor.id.in_range(node.remote.id, ideal_id.advance(1)):
-                return AliveRemoteNode(successor, self.node_pool.timings.live_interval)
+            if successor is not None and successor.id.in_half_closed_range(node.remote.id, ideal_id):
+                return AliveRemoteNode(successor, self._live_deadline())
             else:
                 return node
 
@@ -232,23 +323,50 @@ class HostedVirtualNode:
             if n is not None and n.id.in_range(self.id, successor.id):
                 successor = n
             else:
-                self.successor = AliveRemoteNode(successor, self.node_pool.timings.live_interval)
+                self.successor = AliveRemoteNode(successor, self._live_deadline())
                 break
 
     async def _network_get_pred_or_eq(self, query_id: swarm_id.SwarmId) -> Optional[remote_node.RemoteNode]:
         """
-        Tries to find node with id the same as specified or below specified in whole the network.
+        Tries to find node with id the same as specified or below specified in whole the network. Found nodes are
+        cached for live interval, cache is dropped as soon as routing table gets a better node.
+        :param query_id: upper search bound.
+        :return: found node or None, if no remote nodes found.
+        """
+        cached = self._lookup_cache.get(query_id)
+        if cached is not None and self._loop.time() < cached[1]:
+            return cached[0]
+        node = await self._network_lookup(query_id)
+        if node is not None:
+            self._lookup_cache[query_id] = (node, self._live_deadline())
+        return node
+
+    async def _network_lookup(self, query_id: swarm_id.SwarmId) -> Optional[remote_node.RemoteNode]:
+        """
+        Walks the network from the closest known node to find node with id the same as specified or below specified.
+        If node pool does not know any nodes, walks from bootstrap nodes in round-robin order until one of them
+        succeeds. Every bootstrap is tried at most once.
         :param query_id: upper search bound.
         :return: found node or None, if no remote nodes found.
         """
         start = self.node_pool.pool_get_pred_or_eq_node(query_id)
-        start_is_bootstrap = False
-        if start is None:
-            bootstraps: list[remote_node.RemoteNode] = self.node_pool.get_bootstraps()
-            if len(bootstraps) == 0:
-                return None
-            start = random.choice(bootstraps)
-            start_is_bootstrap = True
+        if start is not None:
+            return await self._walk_network(start, False, query_id)
+        for _ in range(len(self.node_pool.get_bootstraps())):
+            node = await self._walk_network(self.node_pool.get_next_bootstrap(), True, query_id)
+            if node is not None:
+                return node
+        return None
+
+    async def _walk_network(self, start: remote_node.RemoteNode, start_is_bootstrap: bool,
+                            query_id: swarm_id.SwarmId) -> Optional[remote_node.RemoteNode]:
+        """
+        Follows GetNode calls from start node towards the node with id the same as specified or below specified.
+        :param start: first node to query.
+        :param start_is_bootstrap: True, if start is a bootstrap node which id is not known.
+        :param query_id: upper search bound.
+        :return: found node or None, if no remote nodes found.
+        """
         while True:
             next_node = await self._remote_get_node_call(start, query_id)
             if next_node is None:
@@ -274,10 +392,15 @@ class HostedVirtualNode:
         :param query_id: upper search bound.
         :return: found node or None, if no remote nodes found.
         """
-        for node in self.predecessor, *self.finger_table[::-1], self.successor:
+        # query and node ids are converted to ints once, the scan itself only compares ring distances:
+        # query_id is in [node.id, self.id) range
+        query = query_id.__index__()
+        own = self.id.__index__()
+        for node in itertools.chain((self.predecessor,), reversed(self.finger_table), (self.successor,)):
             if node is None:
                 continue
-            if query_id.in_range(node.remote.id.advance(-1), self.id):
+            start = node.remote.id.__index__()
+            if ((query - start) & swarm_id.SwarmId.id_mask) < ((own - start) & swarm_id.SwarmId.id_mask):
                 return node.remote
         return None
 
@@ -297,6 +420,10 @@ class HostedVirtualNode:
             return None
         return resp.remote_node
 
+    def _live_deadline(self) -> float:
+        """Returns liveness deadline for a remote node that is known to be alive now."""
+        return self._loop.time() + self.node_pool.timings.live_interval
+
     async def _check_alive(self, remote: Optional[AliveRemoteNode]) -> bool:
         """
         Checks if remote node is still alive and haven't reached timeouts.
@@ -305,13 +432,13 @@ class HostedVirtualNode:
         """
         if remote is None:
             return False
-        now = datetime.datetime.now()
+        now = self._loop.time()
         if now >= remote.timeout:
             if remote.sent_ping:
                 return False
             else:
                 remote.sent_ping = True
-                remote.timeout = now + datetime.timedelta(seconds=self.node_pool.timings.command_timeout)
+                remote.timeout = now + self.node_pool.timings.command_timeout
                 resp = await self.send_request(remote.remote, rpc.RpcPingRequest(self.id, remote.remote.id),
                                                self.node_pool.timings.command_timeout)
                 if resp is None or not isinstance(resp, rpc.RpcPingResponse):
@@ -324,27 +451,29 @@ class HostedVirtualNode:
         :param remote: remote node to use in stabilization.
         """
         remote_id = remote.remote.id
+        routing_changed = False
         if ((self.predecessor is None and remote_id != self.id) or
                 (self.predecessor is not None and remote_id.in_range(self.predecessor.remote.id, self.id))):
             self.predecessor = remote
+            routing_changed = True
         if ((self.successor is None and remote_id != self.id) or
                 (self.successor is not None and remote_id.in_range(self.id, self.successor.remote.id))):
             self.successor = remote
+            routing_changed = True
         for i in range(_finger_table_size):
-            ideal_id = self.id.advance(2 ** (swarm_id.SwarmId.bit_size - _finger_table_size + i))
+            ideal_id = self._ideal_ids[i]
             finger = self.finger_table[i]
             if ((finger is not None and remote_id.in_range(finger.remote.id, ideal_id)) or
                     (finger is None and remote_id.in_range(self.id, ideal_id))):
                 self.finger_table[i] = remote
-        for n in self._swarm:
-            if n.remote.address == remote.remote.address:
-                break
-        else:
-            if remote_id == self.id:
-                self._swarm.append(remote)
+                routing_changed = True
+        if routing_changed:
+            self._lookup_cache.clear()
+        if remote_id == self.id and remote.remote.address not in self._swarm:
+            self._swarm[remote.remote.address] = remote
 
     def get_swarm(self) -> list:
         """
         :return: addresses of all nodes in swarm.
         """
-        return list(map(lambda x: x.remote.address, self._swarm))
+        return list(self._swarm)
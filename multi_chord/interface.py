@@ -11,3 +11,11 @@ class Interface:
         :param message: rpc message.
         """
         pass
+
+    def send_batch(self, remote, messages):
+        """
+        Sends several serialized rpc messages to the specified description in one datagram.
+        :param remote: remote node destination.
+        :param messages: list of serialized rpc messages.
+        """
+        pass
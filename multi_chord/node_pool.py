@@ -1,6 +1,7 @@
 import asyncio
+import bisect
 import traceback
-from typing import Optional
+from typing import Optional, Callable
 
 from . import hosted_virtual_node
 from . import remote_node
@@ -9,6 +10,21 @@ from . import rpc
 from . import interface
 from . import timings
 
+# max udp payload over ipv4. Batch is flushed early rather than grown past one datagram
+_max_batch_size = 65507
+
+
+class OutboundBatch:
+    """
+    Helper class to keep serialized messages queued to one address along with their total size.
+    """
+    __slots__ = ("remote", "messages", "size")
+
+    def __init__(self, remote: remote_node.RemoteNode, data: bytes):
+        self.remote = remote
+        self.messages = [data]
+        self.size = len(data)
+
 
 class NodePool:
     """
@@ -26,7 +42,13 @@ class NodePool:
         self.timings = t
         self._hosted_virtual_nodes: dict[
             swarm_id.SwarmId, tuple[hosted_virtual_node.HostedVirtualNode, asyncio.Task]] = {}
+        self._sorted_hosted_ids: list[swarm_id.SwarmId] = []
         self._bootstraps: list[remote_node.RemoteNode] = []
+        self._next_bootstrap = 0
+        # remote address -> serialized messages waiting for the batch window to end
+        self._outbound: dict[str, OutboundBatch] = {}
+        # one timer flushes batches to all addresses at the end of the batch window
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
 
     def add_remote_bootstrap(self, address: str):
         """
@@ -48,11 +70,14 @@ class NodePool:
         async def coroutine_unhandled_exception_guard():
             try:
                 await node.stabilize_run()
-            except:
+            except Exception:
                 print(traceback.format_exc())
 
-        task = asyncio.get_event_loop().create_task(coroutine_unhandled_exception_guard())
+        # the hosted nodes dict keeps a strong reference to the task for the whole lifetime of the node
+        task = asyncio.get_running_loop().create_task(coroutine_unhandled_exception_guard(),
+                                                      name=f"stabilize-{node.id.hex()}")
         self._hosted_virtual_nodes[node.id] = (node, task)
+        bisect.insort(self._sorted_hosted_ids, node.id)
 
     def get_hosted_virtual_nodes(self) -> list[hosted_virtual_node.HostedVirtualNode]:
         """
@@ -69,6 +94,15 @@ class NodePool:
         """
         return self._bootstraps
 
+    def get_next_bootstrap(self) -> remote_node.RemoteNode:
+        """
+        Picks bootstrap nodes in round-robin order, so consecutive lookups do not start from the same dead bootstrap.
+        :return: next bootstrap node. There must be at least one bootstrap node.
+        """
+        bootstrap = self._bootstraps[self._next_bootstrap % len(self._bootstraps)]
+        self._next_bootstrap = (self._next_bootstrap + 1) % len(self._bootstraps)
+        return bootstrap
+
     def process_message(self, remote: remote_node.RemoteNode, message: rpc.RpcMessage):
         """
         Processes incoming message from a network interface
@@ -89,6 +123,48 @@ class NodePool:
         """
         self._iface.send_message(remote, message)
 
+    def send_batched(self, remote: remote_node.RemoteNode, message: rpc.RpcMessage):
+        """
+        Queues message to specified remote node. Messages queued to one address within the batch window are sent in one
+        datagram. Message is serialized immediately, so caller may reuse the message object.
+        :param remote: message destination
+        :param message: rpc message
+        """
+        data = message.to_bytes()
+        batch = self._outbound.get(remote.address)
+        if batch is not None and batch.size + len(data) > _max_batch_size:
+            del self._outbound[remote.address]
+            self._send_batch(batch)
+            batch = None
+        if batch is None:
+            self._outbound[remote.address] = OutboundBatch(remote, data)
+            if self._flush_handle is None:
+                self._flush_handle = asyncio.get_running_loop().call_later(self.timings.batch_window,
+                                                                           self._flush_batches)
+        else:
+            batch.messages.append(data)
+            batch.size += len(data)
+
+    def _flush_batches(self):
+        """
+        Sends all queued batches, one datagram per address.
+        """
+        self._flush_handle = None
+        batches, self._outbound = self._outbound, {}
+        for batch in batches.values():
+            self._send_batch(batch)
+
+    def _send_batch(self, batch: OutboundBatch):
+        """
+        Sends queued messages to the batch destination in one datagram.
+        :param batch: messages queued to one address
+        """
+        # addresses come from remote nodes, so a bad one must not prevent sending batches to other addresses
+        try:
+            self._iface.send_batch(batch.remote, batch.messages)
+        except Exception:
+            print(f"failed to send batch to {batch.remote.address}:\n{traceback.format_exc()}")
+
     def _process_zero_swarm(self, remote: remote_node.RemoteNode, message: rpc.RpcMessage):
         """
         Handles incoming messages to the zero node. Zero node responses only to ping requests and GetNode queries.
@@ -97,25 +173,51 @@ class NodePool:
         :param remote: message sender
         :param message: rpc request message
         """
-        if isinstance(message, rpc.RpcPingRequest):
-            self._iface.send_message(remote, rpc.RpcPingResponse(swarm_id.zero_id, remote.id))
-        elif isinstance(message, rpc.RpcGetNodeRequest):
-            resp = self.pool_get_pred_or_eq_node(message.query_id)
-            for hvn_id in self._hosted_virtual_nodes:
-                if resp is None or hvn_id.in_range(resp.id, message.query_id.advance(1)):
-                    resp = remote_node.RemoteNode(hvn_id, "")
-                    break
-            if resp is None:
-                resp = remote_node.zero_node
-            self._iface.send_message(remote, rpc.RpcGetNodeResponse(swarm_id.zero_id, remote.id, resp))
+        handler = NodePool._zero_swarm_handlers.get(message.command)
+        if handler is not None:
+            handler(self, remote, message)
+
+    def _handle_zero_ping(self, remote: remote_node.RemoteNode, message: rpc.RpcPingRequest):
+        self._iface.send_message(remote, rpc.RpcPingResponse(swarm_id.zero_id, remote.id, message.req_id))
+
+    def _handle_zero_get_node(self, remote: remote_node.RemoteNode, message: rpc.RpcGetNodeRequest):
+        hosted_id = self._hosted_pred_or_eq_id(message.query_id)
+        if hosted_id is None:
+            resp = remote_node.zero_node
+        elif hosted_id == message.query_id:
+            # no known node can be closer than the queried id itself
+            resp = remote_node.RemoteNode(hosted_id, "")
+        else:
+            resp = self.pool_get_pred_or_eq_node(message.query_id, remote_node.RemoteNode(hosted_id, ""))
+        self._iface.send_message(remote, rpc.RpcGetNodeResponse(swarm_id.zero_id, remote.id, resp, message.req_id))
+
+    # request type -> zero node handler
+    _zero_swarm_handlers: dict[rpc.RpcMessageType, Callable] = {
+        rpc.RpcMessageType.PING_REQUEST: _handle_zero_ping,
+        rpc.RpcMessageType.GET_NODE_REQUEST: _handle_zero_get_node,
+    }
+
+    def _hosted_pred_or_eq_id(self, query_id: swarm_id.SwarmId) -> Optional[swarm_id.SwarmId]:
+        """
+        :param query_id: id to search for
+        :return: Id of the hosted virtual node that is the nearest to precede query_id or has it as id. None if the pool
+        hosts no virtual nodes.
+        """
+        if not self._sorted_hosted_ids:
+            return None
+        # index -1 wraps around to the largest hosted id, which precedes ids below the smallest hosted id on the ring
+        return self._sorted_hosted_ids[bisect.bisect_right(self._sorted_hosted_ids, query_id) - 1]
 
-    def pool_get_pred_or_eq_node(self, query_id: swarm_id.SwarmId) -> Optional[remote_node.RemoteNode]:
+    def pool_get_pred_or_eq_node(self, query_id: swarm_id.SwarmId,
+                                 candidate: Optional[remote_node.RemoteNode] = None) -> \
+            Optional[remote_node.RemoteNode]:
         """
         :param query_id: id to search for
+        :param candidate: already known node that precedes query_id. It is replaced only by strictly nearer nodes.
         :return: Nearest alive and known remote node in all hosted virtual nodes that precedes query_id or has it as id.
         """
         query_id = query_id.advance(1)
-        resp = None
+        resp = candidate
         for hvn_id in self._hosted_virtual_nodes:
             hvn = self._hosted_virtual_nodes[hvn_id][0]
             r = hvn.local_get_pred_or_eq(query_id)
@@ -1,20 +1,36 @@
+from typing import Optional
+
 from . import swarm_id
 
 
 class RemoteNode:
     """
-    RemoteNode specifies a remote node by swarm id and node network address.
+    RemoteNode specifies a remote node by swarm id and node network address. Remote nodes are immutable, so the hash is
+    computed on first use and cached.
     """
+    __slots__ = ("id", "address", "_hash", "_encoded_address")
 
     def __init__(self, id: swarm_id.SwarmId, address: str):
         self.id = id
         self.address = address
+        self._hash: Optional[int] = None
+        self._encoded_address: Optional[bytes] = None
+
+    def encoded_address(self) -> bytes:
+        """Returns utf-8 encoded address. Encoding is computed on first use, as the node is serialized repeatedly."""
+        if self._encoded_address is None:
+            self._encoded_address = self.address.encode("utf-8")
+        return self._encoded_address
 
     def __eq__(self, other):
+        if self is other:
+            return True
         return self.id == other.id and self.address == other.address
 
     def __hash__(self):
-        return hash((self.id, self.address))
+        if self._hash is None:
+            self._hash = hash((self.id, self.address))
+        return self._hash
 
     def __str__(self):
         return f"RemoteNode(id={self.id}, address={self.address})"
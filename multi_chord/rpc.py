@@ -1,9 +1,17 @@
+import struct
 from enum import IntEnum
-from typing import Optional
+from typing import Optional, Callable
 
 from . import remote_node
 from . import swarm_id
 
+# from_id, to_id, message type, request id
+_header = struct.Struct(f"<{swarm_id.SwarmId.bytes_size}s{swarm_id.SwarmId.bytes_size}sBI")
+# length and count prefixes
+_u32 = struct.Struct("<I")
+# remote node id and address length
+_remote_node_prefix = struct.Struct(f"<{swarm_id.SwarmId.bytes_size}sI")
+
 
 class RpcMessageType(IntEnum):
     """This enum defines a type of RPC message"""
@@ -24,26 +32,38 @@ class RpcMessageType(IntEnum):
 
 
 class RpcMessage:
-    """Common rpc message header. Source, destination and message type"""
+    """Common rpc message header. Source, destination, message type and request id. Response message carries the
+    request id of the request it answers, so caller can match responses with its in-flight requests."""
 
-    def __init__(self, from_id: swarm_id.SwarmId, to_id: swarm_id.SwarmId, command: RpcMessageType):
+    def __init__(self, from_id: swarm_id.SwarmId, to_id: swarm_id.SwarmId, command: RpcMessageType, req_id: int = 0):
         self.from_id = from_id
         self.to_id = to_id
         self.command = command
+        self.req_id = req_id
 
     def __eq__(self, other):
-        return self.from_id == other.from_id and self.to_id == other.to_id and self.command == other.command
+        return (self.from_id == other.from_id and self.to_id == other.to_id and self.command == other.command and
+                self.req_id == other.req_id)
 
     def to_bytes(self) -> bytes:
-        return self.from_id.id + self.to_id.id + self.command.value.to_bytes(1, byteorder="little", signed=False)
+        return b"".join((_header.pack(self.from_id.id, self.to_id.id, self.command.value, self.req_id),
+                         *self.payload_parts()))
+
+    def payload(self) -> bytes:
+        """Returns serialized message fields that follow the header."""
+        return b"".join(self.payload_parts())
+
+    def payload_parts(self) -> list[bytes | memoryview]:
+        """Returns serialized message fields as a list of fragments, so the whole message is joined in one copy."""
+        return []
 
 
 class RpcPingRequest(RpcMessage):
     """Rpc ping request. Alive node must respond with RpcPingResponse response to this request.
     Also notifies callee about existence of the caller."""
 
-    def __init__(self, from_id: swarm_id.SwarmId, to_id: swarm_id.SwarmId):
-        super().__init__(from_id, to_id, RpcMessageType.PING_REQUEST)
+    def __init__(self, from_id: swarm_id.SwarmId, to_id: swarm_id.SwarmId, req_id: int = 0):
+        super().__init__(from_id, to_id, RpcMessageType.PING_REQUEST, req_id)
 
     def __str__(self):
         return f"RpcPingRequest(from_id={self.from_id}, to_id={self.to_id})"
@@ -52,8 +72,8 @@ class RpcPingRequest(RpcMessage):
 class RpcPingResponse(RpcMessage):
     """Rpc ping response"""
 
-    def __init__(self, from_id: swarm_id.SwarmId, to_id: swarm_id.SwarmId):
-        super().__init__(from_id, to_id, RpcMessageType.PING_RESPONSE)
+    def __init__(self, from_id: swarm_id.SwarmId, to_id: swarm_id.SwarmId, req_id: int = 0):
+        super().__init__(from_id, to_id, RpcMessageType.PING_RESPONSE, req_id)
 
     def __str__(self):
         return f"RpcPingResponse(from_id={self.from_id}, to_id={self.to_id})"
@@ -63,12 +83,13 @@ class RpcGetNodeRequest(RpcMessage):
     """Rpc get node request. Returns nearest known node with id below or equal to specified one or
     zero node if node pool does not know any other nodes. Send this request to zero id of the node pool."""
 
-    def __init__(self, from_id: swarm_id.SwarmId, to_id: swarm_id.SwarmId, query_id: swarm_id.SwarmId):
-        super().__init__(from_id, to_id, RpcMessageType.GET_NODE_REQUEST)
+    def __init__(self, from_id: swarm_id.SwarmId, to_id: swarm_id.SwarmId, query_id: swarm_id.SwarmId,
+                 req_id: int = 0):
+        super().__init__(from_id, to_id, RpcMessageType.GET_NODE_REQUEST, req_id)
         self.query_id = query_id
 
-    def to_bytes(self) -> bytes:
-        return super().to_bytes() + self.query_id.id
+    def payload_parts(self) -> list[bytes | memoryview]:
+        return [self.query_id.id]
 
     def __eq__(self, other):
         return super().__eq__(other) and self.query_id == other.query_id
@@ -81,12 +102,12 @@ class RpcGetNodeResponse(RpcMessage):
     """Rpc get node response"""
 
     def __init__(self, from_id: swarm_id.SwarmId, to_id: swarm_id.SwarmId,
-                 remote: remote_node.RemoteNode):
-        super().__init__(from_id, to_id, RpcMessageType.GET_NODE_RESPONSE)
+                 remote: remote_node.RemoteNode, req_id: int = 0):
+        super().__init__(from_id, to_id, RpcMessageType.GET_NODE_RESPONSE, req_id)
         self.remote_node = remote
 
-    def to_bytes(self) -> bytes:
-        return super().to_bytes() + _serialize_remote_node(self.remote_node)
+    def payload_parts(self) -> list[bytes | memoryview]:
+        return _serialize_remote_node(self.remote_node)
 
     def __eq__(self, other):
         return super().__eq__(other) and self.remote_node == other.remote_node
@@ -98,8 +119,8 @@ class RpcGetNodeResponse(RpcMessage):
 class RpcGetSwarmRequest(RpcMessage):
     """Returns a node list in the callee swarm"""
 
-    def __init__(self, from_id: swarm_id.SwarmId, to_id: swarm_id.SwarmId):
-        super().__init__(from_id, to_id, RpcMessageType.GET_SWARM_REQUEST)
+    def __init__(self, from_id: swarm_id.SwarmId, to_id: swarm_id.SwarmId, req_id: int = 0):
+        super().__init__(from_id, to_id, RpcMessageType.GET_SWARM_REQUEST, req_id)
 
     def __str__(self):
         return f"RpcGetSwarmRequest(from_id={self.from_id}, to_id={self.to_id})"
@@ -109,15 +130,15 @@ class RpcGetSwarmResponse(RpcMessage):
     """Rpc get swarm response"""
 
     def __init__(self, from_id: swarm_id.SwarmId, to_id: swarm_id.SwarmId,
-                 swarm: list[remote_node.RemoteNode]):
-        super().__init__(from_id, to_id, RpcMessageType.GET_SWARM_RESPONSE)
+                 swarm: list[remote_node.RemoteNode], req_id: int = 0):
+        super().__init__(from_id, to_id, RpcMessageType.GET_SWARM_RESPONSE, req_id)
         self.swarm = swarm
 
-    def to_bytes(self) -> bytes:
-        serialized = super().to_bytes() + len(self.swarm).to_bytes(4, byteorder="little", signed=False)
+    def payload_parts(self) -> list[bytes | memoryview]:
+        parts = [_u32.pack(len(self.swarm))]
         for node in self.swarm:
-            serialized += _serialize_remote_node(node)
-        return serialized
+            parts += _serialize_remote_node(node)
+        return parts
 
     def __eq__(self, other):
         if len(self.swarm) != len(other.swarm):
@@ -134,8 +155,8 @@ class RpcGetSwarmResponse(RpcMessage):
 class RpcGetContentRequest(RpcMessage):
     """Returns stored content or zero data of callee haven't got any data yet."""
 
-    def __init__(self, from_id: swarm_id.SwarmId, to_id: swarm_id.SwarmId):
-        super().__init__(from_id, to_id, RpcMessageType.GET_CONTENT_REQUEST)
+    def __init__(self, from_id: swarm_id.SwarmId, to_id: swarm_id.SwarmId, req_id: int = 0):
+        super().__init__(from_id, to_id, RpcMessageType.GET_CONTENT_REQUEST, req_id)
 
     def __str__(self):
         return f"RpcGetContentRequest(from_id={self.from_id}, to_id={self.to_id})"
@@ -144,12 +165,13 @@ class RpcGetContentRequest(RpcMessage):
 class RpcGetContentResponse(RpcMessage):
     """Rpc get content response"""
 
-    def __init__(self, from_id: swarm_id.SwarmId, to_id: swarm_id.SwarmId, data: bytes):
-        super().__init__(from_id, to_id, RpcMessageType.GET_CONTENT_RESPONSE)
+    def __init__(self, from_id: swarm_id.SwarmId, to_id: swarm_id.SwarmId, data: bytes | memoryview,
+                 req_id: int = 0):
+        super().__init__(from_id, to_id, RpcMessageType.GET_CONTENT_RESPONSE, req_id)
         self.data = data
 
-    def to_bytes(self) -> bytes:
-        return super().to_bytes() + len(self.data).to_bytes(4, byteorder="little", signed=False) + self.data
+    def payload_parts(self) -> list[bytes | memoryview]:
+        return [_u32.pack(len(self.data)), self.data]
 
     def __eq__(self, other):
         return super().__eq__(other) and self.data == other.data
@@ -158,107 +180,154 @@ class RpcGetContentResponse(RpcMessage):
         return f"RpcGetContentResponse(from_id={self.from_id}, to_id={self.to_id}, len(data)={len(self.data)})"
 
 
-def _parse_remote_node(msg: bytes) -> tuple[Optional[remote_node.RemoteNode], bytes]:
-    if len(msg) < swarm_id.SwarmId.bytes_size + 4:
-        return None, msg
-    addr_len = int.from_bytes(msg[swarm_id.SwarmId.bytes_size: swarm_id.SwarmId.bytes_size + 4], byteorder="little",
-                              signed=False)
-    if len(msg) < swarm_id.SwarmId.bytes_size + 4 + addr_len:
-        return None, msg
-    node_id = swarm_id.SwarmId(msg[:swarm_id.SwarmId.bytes_size])
-    addr = msg[swarm_id.SwarmId.bytes_size + 4:swarm_id.SwarmId.bytes_size + 4 + addr_len].decode("utf-8")
-    return remote_node.RemoteNode(node_id, addr), msg[swarm_id.SwarmId.bytes_size + 4 + addr_len:]
+def _parse_remote_node(msg: memoryview, offset: int, fallback_address: str) -> \
+        tuple[Optional[remote_node.RemoteNode], int]:
+    if len(msg) < offset + _remote_node_prefix.size:
+        return None, offset
+    node_id, addr_len = _remote_node_prefix.unpack_from(msg, offset)
+    addr_offset = offset + _remote_node_prefix.size
+    if len(msg) < addr_offset + addr_len:
+        return None, offset
+    addr = str(msg[addr_offset:addr_offset + addr_len], "utf-8")
+    if addr == "":
+        addr = fallback_address
+    return remote_node.RemoteNode(swarm_id.interned(node_id), addr), addr_offset + addr_len
 
 
-def _serialize_remote_node(node: remote_node.RemoteNode) -> bytes:
-    serialized_address = node.address.encode("utf-8")
-    return (node.id.id + len(serialized_address).to_bytes(4, byteorder="little", signed=False) +
-            serialized_address)
+def _serialize_remote_node(node: remote_node.RemoteNode) -> list[bytes]:
+    serialized_address = node.encoded_address()
+    return [node.id.id, _u32.pack(len(serialized_address)), serialized_address]
 
 
-def parse_rpc_message(msg: bytes, address) -> tuple[Optional[RpcMessage], bytes]:
+def parse_rpc_message(msg: bytes | memoryview, address: str, offset: int = 0) -> tuple[Optional[RpcMessage], int]:
     """
-    Deserializes rpc message from byte string.
-    :param msg: byte string
+    Deserializes rpc message from byte string. Fields are read in place, only ids, addresses and content are copied
+    out of the buffer.
+    :param msg: byte string or a view of it
     :param address: address of the sender. Used as a fallback address if sender hasn't
     specified it (means that sender referrers to themselves)
-    :return: rpc message if parsed successfully, unparsed remained bytes
+    :param offset: position of the message in msg
+    :return: rpc message if parsed successfully and offset of the unparsed remainder. Offset is not advanced if
+    message is incomplete. Message of unknown type discards the whole remainder.
     """
-    if len(msg) < swarm_id.SwarmId.bytes_size + swarm_id.SwarmId.bytes_size + 1:
-        return None, msg
-    from_id = swarm_id.SwarmId(msg[:swarm_id.SwarmId.bytes_size])
-    to_id = swarm_id.SwarmId(msg[swarm_id.SwarmId.bytes_size: swarm_id.SwarmId.bytes_size * 2])
-    command = RpcMessageType(msg[swarm_id.SwarmId.bytes_size * 2])
-    header_len = swarm_id.SwarmId.bytes_size * 2 + 1
-    if command == RpcMessageType.PING_REQUEST:
-        return RpcPingRequest(from_id, to_id), msg[header_len:]
-    elif command == RpcMessageType.PING_RESPONSE:
-        return RpcPingResponse(from_id, to_id), msg[header_len:]
-    elif command == RpcMessageType.GET_NODE_REQUEST:
-        if len(msg) < header_len + swarm_id.SwarmId.bytes_size:
-            return None, msg
-        query_id = swarm_id.SwarmId(msg[header_len:header_len + swarm_id.SwarmId.bytes_size])
-        return RpcGetNodeRequest(from_id, to_id, query_id), msg[header_len + swarm_id.SwarmId.bytes_size:]
-    elif command == RpcMessageType.GET_NODE_RESPONSE:
-        node, msg_remainder = _parse_remote_node(msg[header_len:])
-        if node is None:
-            return None, msg
-        if node.address == "":
-            node.address = address
-        return RpcGetNodeResponse(from_id, to_id, node), msg_remainder
-    elif command == RpcMessageType.GET_SWARM_REQUEST:
-        return RpcGetSwarmRequest(from_id, to_id), msg[header_len:]
-    elif command == RpcMessageType.GET_SWARM_RESPONSE:
-        if len(msg) < header_len + 4:
-            return None, msg
-        count = int.from_bytes(msg[header_len:header_len + 4], byteorder="little", signed=False)
-        swarm: list[remote_node.RemoteNode] = []
-        msg_remainder = msg[header_len + 4:]
-        for i in range(count):
-            node, msg_remainder = _parse_remote_node(msg_remainder)
-            if node is None:
-                return None, msg
-            if node.address == "":
-                node.address = address
-            swarm.append(node)
-        return RpcGetSwarmResponse(from_id, to_id, swarm), msg_remainder
-    elif command == RpcMessageType.GET_CONTENT_REQUEST:
-        return RpcGetContentRequest(from_id, to_id), msg[header_len:]
-    elif command == RpcMessageType.GET_CONTENT_RESPONSE:
-        if len(msg) < header_len + 4:
-            return None, msg
-        length = int.from_bytes(msg[header_len:header_len + 4], byteorder="little", signed=False)
-        if len(msg) < header_len + 4 + length:
-            return None, msg
-        return (RpcGetContentResponse(from_id, to_id, msg[header_len + 4:header_len + 4 + length]),
-                msg[header_len + 4 + length:])
-    else:
-        return None, b""
-
-
-# simple serialization/deserialization test section to ensure implementation correctness
-
-_from_id = swarm_id.SwarmId(
-    "384337abeaa3a24884ba6ce6df7e7c533569091f89f102a940ac19242e4947ac41d80c5e2fb4babc825113d2c06c5e44a39c9da3ca4d3fb8cf5969c2def21c7f")
-_to_id = swarm_id.SwarmId(
-    "cf83e1357eefb8bdf1542850d66d8007d620e4050b5715dc83f4a921d36ce9ce47d0d13c5d85f2b0ff8318d2877eec2f63b931bd47417a81a538327af927da3e")
-_swarm_id = swarm_id.SwarmId(
-    "8fb29448faee18b656030e8f5a8b9e9a695900f36a3b7d7ebb0d9d51e06c8569d81a55e39b481cf50546d697e7bde1715aa6badede8ddc801c739777be77f166")
-_address = "123"
-_data = b"123"
-_test_rpc_ping_request = RpcPingRequest(_from_id, _to_id)
-_test_rpc_ping_response = RpcPingResponse(_from_id, _to_id)
-_test_rpc_get_node_request = RpcGetNodeRequest(_from_id, _to_id, _swarm_id)
-_test_rpc_get_node_response = RpcGetNodeResponse(_from_id, _to_id, remote_node.RemoteNode(_swarm_id, _address))
-_test_rpc_get_swarm_request = RpcGetSwarmRequest(_from_id, _to_id)
-_test_rpc_get_swarm_response = RpcGetSwarmResponse(_from_id, _to_id, [remote_node.RemoteNode(_swarm_id, _address)])
-_test_rpc_get_content_request = RpcGetContentRequest(_from_id, _to_id)
-_test_rpc_get_content_response = RpcGetContentResponse(_from_id, _to_id, _data)
-_tests = [_test_rpc_ping_request, _test_rpc_ping_response, _test_rpc_get_node_request, _test_rpc_get_node_response,
-          _test_rpc_get_swarm_request, _test_rpc_get_swarm_response, _test_rpc_get_content_request,
-          _test_rpc_get_content_response]
-
-for _t in _tests:
-    _a, _b = parse_rpc_message(_t.to_bytes(), "")
-    assert len(_b) == 0
-    assert _a == _t
+    msg = memoryview(msg)
+    body = offset + _header.size
+    if len(msg) < body:
+        return None, offset
+    raw_from_id, raw_to_id, command_value, req_id = _header.unpack_from(msg, offset)
+    from_id = swarm_id.interned(raw_from_id)
+    to_id = swarm_id.interned(raw_to_id)
+    # raw type byte indexes parsers directly, message constructors set the enum type
+    if command_value >= len(_parsers):
+        return None, len(msg)
+    message, end = _parsers[command_value](msg, body, from_id, to_id, req_id, address)
+    if message is None:
+        return None, offset
+    return message, end
+
+
+# Message body parsers. Every parser gets message buffer, body offset and parsed header fields and returns parsed
+# message with the offset of its end, or None if message is incomplete.
+
+def _header_only_parser(message_type: type) -> Callable:
+    def parse(msg: memoryview, body: int, from_id: swarm_id.SwarmId, to_id: swarm_id.SwarmId, req_id: int,
+              address: str) -> tuple[Optional[RpcMessage], int]:
+        return message_type(from_id, to_id, req_id), body
+
+    return parse
+
+
+def _parse_get_node_request(msg: memoryview, body: int, from_id: swarm_id.SwarmId, to_id: swarm_id.SwarmId,
+                            req_id: int, address: str) -> tuple[Optional[RpcMessage], int]:
+    end = body + swarm_id.SwarmId.bytes_size
+    if len(msg) < end:
+        return None, body
+    return RpcGetNodeRequest(from_id, to_id, swarm_id.interned(bytes(msg[body:end])), req_id), end
+
+
+def _parse_get_node_response(msg: memoryview, body: int, from_id: swarm_id.SwarmId, to_id: swarm_id.SwarmId,
+                             req_id: int, address: str) -> tuple[Optional[RpcMessage], int]:
+    node, end = _parse_remote_node(msg, body, address)
+    if node is None:
+        return None, body
+    return RpcGetNodeResponse(from_id, to_id, node, req_id), end
+
+
+def _parse_get_swarm_response(msg: memoryview, body: int, from_id: swarm_id.SwarmId, to_id: swarm_id.SwarmId,
+                              req_id: int, address: str) -> tuple[Optional[RpcMessage], int]:
+    if len(msg) < body + _u32.size:
+        return None, body
+    count = _u32.unpack_from(msg, body)[0]
+    end = body + _u32.size
+    # every node takes at least its prefix, so the list is preallocated only when all prefixes may be present
+    if len(msg) < end + count * _remote_node_prefix.size:
+        return None, body
+    swarm: list[remote_node.RemoteNode] = [None] * count
+    # nodes are parsed inline with a single advancing offset
+    for i in range(count):
+        addr_offset = end + _remote_node_prefix.size
+        if len(msg) < addr_offset:
+            return None, body
+        node_id, addr_len = _remote_node_prefix.unpack_from(msg, end)
+        end = addr_offset + addr_len
+        if len(msg) < end:
+            return None, body
+        swarm[i] = remote_node.RemoteNode(swarm_id.interned(node_id), str(msg[addr_offset:end], "utf-8") or address)
+    return RpcGetSwarmResponse(from_id, to_id, swarm, req_id), end
+
+
+def _parse_get_content_response(msg: memoryview, body: int, from_id: swarm_id.SwarmId, to_id: swarm_id.SwarmId,
+                                req_id: int, address: str) -> tuple[Optional[RpcMessage], int]:
+    if len(msg) < body + _u32.size:
+        return None, body
+    length = _u32.unpack_from(msg, body)[0]
+    data_offset = body + _u32.size
+    if len(msg) < data_offset + length:
+        return None, body
+    return (RpcGetContentResponse(from_id, to_id, bytes(msg[data_offset:data_offset + length]), req_id),
+            data_offset + length)
+
+
+# parsers indexed by message type
+_parsers: tuple[Callable, ...] = (
+    _header_only_parser(RpcPingRequest),
+    _header_only_parser(RpcPingResponse),
+    _parse_get_node_request,
+    _parse_get_node_response,
+    _header_only_parser(RpcGetSwarmRequest),
+    _parse_get_swarm_response,
+    _header_only_parser(RpcGetContentRequest),
+    _parse_get_content_response,
+)
+assert len(_parsers) == RpcMessageType.LAST_COMMAND + 1
+
+
+# simple serialization/deserialization test section to ensure implementation correctness.
+# Run with python -m multi_chord.rpc
+
+if __name__ == "__main__":
+    _from_id = swarm_id.SwarmId(
+        "384337abeaa3a24884ba6ce6df7e7c533569091f89f102a940ac19242e4947ac41d80c5e2fb4babc825113d2c06c5e44a39c9da3ca4d3fb8cf5969c2def21c7f")
+    _to_id = swarm_id.SwarmId(
+        "cf83e1357eefb8bdf1542850d66d8007d620e4050b5715dc83f4a921d36ce9ce47d0d13c5d85f2b0ff8318d2877eec2f63b931bd47417a81a538327af927da3e")
+    _swarm_id = swarm_id.SwarmId(
+        "8fb29448faee18b656030e8f5a8b9e9a695900f36a3b7d7ebb0d9d51e06c8569d81a55e39b481cf50546d697e7bde1715aa6badede8ddc801c739777be77f166")
+    _address = "123"
+    _data = b"123"
+    _test_rpc_ping_request = RpcPingRequest(_from_id, _to_id, 1)
+    _test_rpc_ping_response = RpcPingResponse(_from_id, _to_id)
+    _test_rpc_get_node_request = RpcGetNodeRequest(_from_id, _to_id, _swarm_id)
+    _test_rpc_get_node_response = RpcGetNodeResponse(_from_id, _to_id, remote_node.RemoteNode(_swarm_id, _address))
+    _test_rpc_get_swarm_request = RpcGetSwarmRequest(_from_id, _to_id)
+    _test_rpc_get_swarm_response = RpcGetSwarmResponse(_from_id, _to_id, [remote_node.RemoteNode(_swarm_id, _address)])
+    _test_rpc_get_content_request = RpcGetContentRequest(_from_id, _to_id)
+    _test_rpc_get_content_response = RpcGetContentResponse(_from_id, _to_id, _data, 2 ** 32 - 1)
+    _tests = [_test_rpc_ping_request, _test_rpc_ping_response, _test_rpc_get_node_request, _test_rpc_get_node_response,
+              _test_rpc_get_swarm_request, _test_rpc_get_swarm_response, _test_rpc_get_content_request,
+              _test_rpc_get_content_response]
+
+    for _t in _tests:
+        _serialized = _t.to_bytes()
+        _a, _b = parse_rpc_message(_serialized, "")
+        assert _b == len(_serialized)
+        assert _a == _t
@@ -1,4 +1,4 @@
-import re
+from typing import Optional
 
 
 class SwarmId:
@@ -9,6 +9,8 @@ class SwarmId:
     bytes_size = 64
     bit_size = 512
     id_max = 2 ** (bytes_size * 8)
+    # id_max is a power of two, so masking is the same as taking a value modulo id_max, negative values included
+    id_mask = id_max - 1
 
     def __init__(self, id: str | bytes):
         """
@@ -16,23 +18,34 @@ class SwarmId:
         :param id: 128-characters hex string or a 64-bytes binary string that represents id.
         """
         if isinstance(id, str):
-            if not re.match("[0-9a-fA-F]{" + str(SwarmId.bytes_size * 2) + "}", id):
+            # bytes.fromhex validates hex digits itself, but skips whitespace, so decoded length is checked as well
+            try:
+                self.id = bytes.fromhex(id)
+            except ValueError:
+                raise ValueError(f"provided string is not id: {id}") from None
+            if len(id) != SwarmId.bytes_size * 2 or len(self.id) != SwarmId.bytes_size:
                 raise ValueError(f"provided string is not id: {id}")
-            self.id = bytes.fromhex(id)
         elif isinstance(id, bytes):
             if not len(id) == 64:
                 raise ValueError(f"provided bytestring of incorrect size: {len(id)} (required {SwarmId.bytes_size})")
             self.id = id
         else:
             raise ValueError("unsupported type for id: " + str(type(id)))
+        # id is immutable. Big int value is needed by almost every id operation, so it is computed once here, along
+        # with the hash derived from it. Hex representation is computed on first use
+        self._int = int.from_bytes(self.id, byteorder="little", signed=False)
+        self._hash = hash(self._int)
+        self._hex: Optional[str] = None
 
     def __index__(self):
         """Transforms id to big int"""
-        return int.from_bytes(self.id, byteorder="little", signed=False)
+        return self._int
 
     def hex(self):
         """Returns a hex representation of the id."""
-        return self.id.hex()
+        if self._hex is None:
+            self._hex = self.id.hex()
+        return self._hex
 
     def __str__(self):
         """Returns a trimmed string representation of the id."""
@@ -43,20 +56,49 @@ class SwarmId:
         a = left.__index__()
         b = self.__index__()
         c = right.__index__()
-        dist_ab = (b - a) % SwarmId.id_max
-        dist_ac = (c - a) % SwarmId.id_max
+        dist_ab = (b - a) & SwarmId.id_mask
+        dist_ac = (c - a) & SwarmId.id_mask
         return dist_ab < dist_ac and a != b and b != c
 
+    def in_half_closed_range(self, left, right) -> bool:
+        """Returns true if self is in (left, right] range."""
+        a = left.__index__()
+        return 0 < ((self.__index__() - a) & SwarmId.id_mask) <= ((right.__index__() - a) & SwarmId.id_mask)
+
     def __eq__(self, other):
-        return self.id == other.id
+        # parsed ids are interned, so most equal ids are the same instance
+        return self is other or self._int == other._int
+
+    def __lt__(self, other):
+        """Compares ids as numbers, so ids can be kept sorted. Ring order is handled by range functions."""
+        return self._int < other._int
 
     def __hash__(self):
-        return hash(self.id)
+        return self._hash
 
     def advance(self, i: int):
         """Returns an advanced SwarmId instance."""
-        v = (self.__index__() + i) % SwarmId.id_max
+        v = (self.__index__() + i) & SwarmId.id_mask
         return SwarmId(v.to_bytes(SwarmId.bytes_size, byteorder="little", signed=False))
 
 
 zero_id = SwarmId(b"\x00" * SwarmId.bytes_size)
+
+_interned_limit = 4096
+# recently parsed ids in insertion order. Shared instances also share their cached int value and hash
+_interned: dict[bytes, SwarmId] = {zero_id.id: zero_id}
+
+
+def interned(id: bytes) -> SwarmId:
+    """
+    Returns a shared SwarmId instance for binary id. The oldest interned id is evicted when the cache is full.
+    :param id: 64-bytes binary string.
+    :return: SwarmId instance.
+    """
+    swarm_id = _interned.get(id)
+    if swarm_id is None:
+        swarm_id = SwarmId(id)
+        if len(_interned) >= _interned_limit:
+            del _interned[next(iter(_interned))]
+        _interned[id] = swarm_id
+    return swarm_id
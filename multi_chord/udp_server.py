@@ -1,5 +1,6 @@
 import asyncio
-import collections
+import functools
+import socket
 from typing import Optional
 
 from . import rpc
@@ -21,7 +22,9 @@ class UdpServer(asyncio.DatagramProtocol, interface.Interface):
         self._node_pool: Optional[node_pool.NodePool] = None
         self._address = address
         self._transport = None
-        self._pending_messages: dict[tuple[str, int], bytes] = collections.defaultdict(lambda: b"")
+        self._sock: Optional[socket.socket] = None
+        # incomplete message tails by sender. Tail is extended in place as next datagrams arrive
+        self._pending_messages: dict[tuple[str, int], bytearray] = {}
 
     def connection_made(self, transport):
         """
@@ -39,16 +42,28 @@ class UdpServer(asyncio.DatagramProtocol, interface.Interface):
         :param data: received data
         :param addr: sender address
         """
-        msg = self._pending_messages[addr] + data
-        address = addr[0] + ":" + str(addr[1])
-        message, remainder = rpc.parse_rpc_message(msg, address)
-        if message is not None:
-            # print(f"got message from {address}: {message}")
-            self._node_pool.process_message(remote_node.RemoteNode(message.from_id, address), message)
-        if len(remainder) > 0:
-            self._pending_messages[addr] = remainder
+        pending = self._pending_messages.get(addr)
+        if pending is not None:
+            pending.extend(data)
+            data = pending
+        address = _format_address(addr)
+        offset = 0
+        # view is released before pending buffer is resized
+        with memoryview(data) as msg:
+            # one datagram may carry a batch of messages written back to back
+            while offset < len(msg):
+                message, offset = rpc.parse_rpc_message(msg, address, offset)
+                if message is None:
+                    break
+                # print(f"got message from {address}: {message}")
+                self._node_pool.process_message(remote_node.RemoteNode(message.from_id, address), message)
+        if offset == len(data):
+            if pending is not None:
+                del self._pending_messages[addr]
+        elif pending is None:
+            self._pending_messages[addr] = bytearray(data[offset:])
         else:
-            del self._pending_messages[addr]
+            del pending[:offset]
 
     async def start(self, pool: node_pool.NodePool):
         """
@@ -57,7 +72,18 @@ class UdpServer(asyncio.DatagramProtocol, interface.Interface):
         """
         assert self._node_pool is None
         self._node_pool = pool
-        await asyncio.get_event_loop().create_datagram_endpoint(lambda: self, self._address)
+        loop = asyncio.get_running_loop()
+        # address family is resolved from the bind address, like create_datagram_endpoint does for local_addr
+        family, _, proto, _, sockaddr = (await loop.getaddrinfo(*self._address, type=socket.SOCK_DGRAM))[0]
+        # server keeps its own socket reference to send datagrams without going through transport buffering
+        self._sock = socket.socket(family, socket.SOCK_DGRAM, proto)
+        try:
+            self._sock.setblocking(False)
+            self._sock.bind(sockaddr)
+            await loop.create_datagram_endpoint(lambda: self, sock=self._sock)
+        except BaseException:
+            self._sock.close()
+            raise
 
     def stop(self):
         """
@@ -71,6 +97,46 @@ class UdpServer(asyncio.DatagramProtocol, interface.Interface):
         :param remote: message destination
         :param message: payload
         """
-        ip, port = remote.address.split(":")
-        self._transport.sendto(message.to_bytes(), (ip, int(port)))
+        self._send_datagram(remote, message.to_bytes())
         # print(f"sent message to {description.address}: {message}")
+
+    def send_batch(self, remote: remote_node.RemoteNode, messages: list[bytes]):
+        """
+        Sends serialized messages to specified remote node in one datagram
+        :param remote: message destination
+        :param messages: serialized messages
+        """
+        self._send_datagram(remote, b"".join(messages))
+
+    def _send_datagram(self, remote: remote_node.RemoteNode, data: bytes):
+        if self._transport is None or self._transport.is_closing():
+            # server is shut down, socket is closed or about to be closed
+            return
+        socket_address = _parse_address(remote.address)
+        try:
+            self._sock.sendto(data, socket_address)
+        except OSError:
+            # let transport buffer the datagram or report the error to error_received()
+            self._transport.sendto(data, socket_address)
+
+
+@functools.lru_cache(maxsize=1024)
+def _format_address(addr: tuple[str, int]) -> str:
+    """
+    Formats socket address as a node address. Peers send many datagrams, so formatted addresses are cached.
+    :param addr: socket address
+    :return: address string in ip:port format
+    """
+    return addr[0] + ":" + str(addr[1])
+
+
+@functools.lru_cache(maxsize=1024)
+def _parse_address(address: str) -> tuple[str, int]:
+    """
+    Parses node address into socket address. Messages to one peer are sent repeatedly, so parsed addresses are
+    cached.
+    :param address: address string in ip:port format
+    :return: socket address
+    """
+    ip, port = address.rsplit(":", 1)
+    return ip, int(port)